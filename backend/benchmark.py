@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+In-process benchmarks for the Maizul API hot paths.
+Run: python benchmark.py [section ...]
+
+No database is needed: payloads are built from the seed menu (SAMPLE_MENU_ITEMS),
+replicated to represent larger menus.
+"""
+
+import asyncio
+import json
+import random
+import sys
+import time
+import timeit
+
+from pydantic import TypeAdapter
+from typing import List
+
+import server
+from server import MenuItem, SAMPLE_MENU_ITEMS
+
+# Typical roaming throughput for a tourist on mobile data, in bytes per second
+ROAMING_BYTES_PER_SECOND = 1_000_000 / 8
+
+def sample_rows(count: int) -> List[dict]:
+    """`count` menu documents, as stored in Mongo, cycling through the seed data"""
+    rows = []
+    for i in range(count):
+        item = dict(SAMPLE_MENU_ITEMS[i % len(SAMPLE_MENU_ITEMS)])
+        item["sort_order"] = i
+        rows.append(MenuItem(**item).model_dump())
+    return rows
+
+def per_call_ms(fn, number: int = 0) -> float:
+    timer = timeit.Timer(fn)
+    if not number:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number * 1000
+
+def bench_compression():
+    """CPU cost of each encoding versus the transfer time it saves on a roaming link"""
+    print("\n📦 Compression (menu payloads)")
+    print(f"   {'items':>5} {'encoding':<10} {'bytes':>8} {'ratio':>6} {'cpu ms':>8} {'saved ms':>9}")
+    for count in (12, 50, 200):
+        body = server.dump_json(sample_rows(count))
+        variants = [("identity", None, None)]
+        for encoding in server.SUPPORTED_ENCODINGS:
+            variants.append((encoding, encoding, None))
+            precompress_level = server.PRECOMPRESS_BROTLI_QUALITY if encoding == "br" else server.PRECOMPRESS_GZIP_LEVEL
+            variants.append((f"{encoding}-pre", encoding, precompress_level))
+        for label, encoding, level in variants:
+            if encoding is None:
+                size, cpu_ms = len(body), 0.0
+            else:
+                size = len(server.compress(body, encoding, level))
+                cpu_ms = per_call_ms(lambda: server.compress(body, encoding, level))
+            saved_ms = (len(body) - size) / ROAMING_BYTES_PER_SECOND * 1000
+            print(f"   {count:>5} {label:<10} {size:>8} {size / len(body):>6.2f} {cpu_ms:>8.3f} {saved_ms:>9.1f}")
+
+    # Precomputed fast path: picking a cached encoding versus compressing per request
+    encoded = server.precompress(server.dump_json(sample_rows(50)))
+    body = encoded["identity"]
+    encoding = server.SUPPORTED_ENCODINGS[0]
+    print(f"   per-request {encoding}: {per_call_ms(lambda: server.compress(body, encoding)):.3f} ms, "
+          f"precomputed lookup: {per_call_ms(lambda: encoded.get(encoding)) * 1000:.3f} µs")
+
+def bench_locations():
+    """Cached GET /api/menu latency and LRU eviction cost as locations grow from 1 to 500"""
+    print("\n🏪 Locations (per-tenant menu cache)")
+    encoded = server.precompress(server.dump_json(sample_rows(24)))
+    per_location = server.encoded_size(encoded)
+    loop = asyncio.new_event_loop()
+    original_cache = server.menu_cache
+    print(f"   {'locations':>9} {'hit µs':>8} {'evicting put µs':>16} {'cache MB':>9}")
+    try:
+        for count in (1, 10, 100, 500):
+            locations = [f"location-{i}" for i in range(count)]
+            picks = random.Random(count).choices(locations, k=2000)
+
+            server.menu_cache = server.TenantMenuCache()
+            for location_id in locations:
+                server.menu_cache.put(location_id, (None, True), 0, encoded)
+
+            async def serve():
+                for location_id in picks:
+                    await server.get_menu(category=None, available_only=True, location_id=location_id)
+
+            hit_us = per_call_ms(lambda: loop.run_until_complete(serve()), number=5) / len(picks) * 1000
+
+            # Budget for a tenth of the locations, so most puts evict the least recently used one
+            tight = server.TenantMenuCache(max_bytes=max(1, count // 10) * per_location)
+
+            def fill():
+                for location_id in picks:
+                    tight.put(location_id, (None, True), tight.version(location_id), encoded)
+
+            put_us = per_call_ms(fill, number=5) / len(picks) * 1000
+            print(f"   {count:>9} {hit_us:>8.2f} {put_us:>16.2f} {server.menu_cache.size_bytes / 1e6:>9.1f}")
+    finally:
+        server.menu_cache = original_cache
+        loop.close()
+
+def bench_serialization():
+    """Per-item cost of building a menu response body from Mongo rows"""
+    print("\n⚡ Serialization (µs per menu item)")
+    adapter = TypeAdapter(List[MenuItem])
+
+    def validated(rows):
+        # Previous path: MenuItem(**row) in the handler, response_model validation, stdlib json
+        items = adapter.validate_python([MenuItem(**row) for row in rows])
+        return json.dumps(adapter.dump_python(items, mode="json"), ensure_ascii=False).encode()
+
+    def constructed(rows):
+        return server.dump_json([MenuItem.model_construct(**row).model_dump() for row in rows])
+
+    def trusted(rows):
+        return server.dump_json(server.trusted_rows(MenuItem, rows))
+
+    def sampled(rows):
+        trusted_rows = server.trusted_rows(MenuItem, rows)
+        server.check_schema(MenuItem, rows, trusted_rows)
+        return server.dump_json(trusted_rows)
+
+    paths = [("validated+json", validated), ("construct+orjson", constructed),
+             ("trusted", trusted), ("trusted+check", sampled)]
+    print(f"   {'items':>5} " + " ".join(f"{label:>17}" for label, _ in paths))
+    for count in (12, 200):
+        rows = sample_rows(count)
+        timings = [per_call_ms(lambda: fn(rows)) * 1000 / count for _, fn in paths]
+        print(f"   {count:>5} " + " ".join(f"{t:>17.2f}" for t in timings))
+    print(f"   trusted+check runs on {server.SCHEMA_SAMPLE_RATE:.0%} of reads (SCHEMA_SAMPLE_RATE)")
+
+def bench_whatsapp():
+    """Warm WhatsApp render for a cart, from the cached menu index (no database)"""
+    print("\n💬 WhatsApp rendering")
+    rows = sample_rows(24)
+    for row in rows:
+        row["location_id"] = server.DEFAULT_LOCATION_ID
+    index = {row["id"]: row for row in rows}
+    original_cache = server.menu_cache
+    server.menu_cache = server.TenantMenuCache()
+    server.menu_cache.put(server.DEFAULT_LOCATION_ID, "index", 0, index, size=len(server.dump_json(rows)))
+    loop = asyncio.new_event_loop()
+    try:
+        for cart_size in (1, 5, 20):
+            for language in ("es", "en"):
+                request = server.WhatsAppRenderRequest(
+                    language=language,
+                    items=[{"item_id": row["id"], "quantity": 2} for row in rows[:cart_size]],
+                    reservation={"name": "Ana", "date": "2026-11-07", "time": "10:00", "party_size": 4},
+                )
+
+                def render():
+                    loop.run_until_complete(
+                        server.render_whatsapp_message(request, location_id=server.DEFAULT_LOCATION_ID)
+                    )
+
+                print(f"   cart {cart_size:>2} items, {language}: {per_call_ms(render) * 1000:.1f} µs")
+    finally:
+        server.menu_cache = original_cache
+        loop.close()
+
+def bench_audit():
+    """Per-request overhead AuditMiddleware adds to an admin mutation"""
+    print("\n📝 Audit middleware")
+
+    async def handler(scope, receive, send):
+        server.audit(actor="admin", actor_id="bench")
+        server.audit_change("item", {"price": 150.0, "updated_at": "2026-01-01T00:00:00+00:00"})
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "PUT", "path": "/api/menu/item", "headers": []}
+    audited = server.AuditMiddleware(handler)
+    loop = asyncio.new_event_loop()
+
+    async def run(app, requests=1000):
+        for _ in range(requests):
+            await app(dict(scope), receive, send)
+            # Stand-in for the background writer
+            while not server.audit_queue.empty():
+                server.audit_queue.get_nowait()
+
+    try:
+        bare_us = per_call_ms(lambda: loop.run_until_complete(run(handler)), number=5)
+        audited_us = per_call_ms(lambda: loop.run_until_complete(run(audited)), number=5)
+    finally:
+        loop.close()
+    print(f"   bare handler: {bare_us:.2f} µs, with audit: {audited_us:.2f} µs, "
+          f"overhead: {audited_us - bare_us:.2f} µs per request")
+
+SECTIONS = {
+    "compression": bench_compression,
+    "locations": bench_locations,
+    "serialization": bench_serialization,
+    "whatsapp": bench_whatsapp,
+    "audit": bench_audit,
+}
+
+def main():
+    selected = sys.argv[1:] or list(SECTIONS)
+    started = time.perf_counter()
+    for name in selected:
+        SECTIONS[name]()
+    print(f"\n✓ Done in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,42 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, status
+from fastapi.responses import JSONResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.datastructures import Headers, MutableHeaders
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from typing import List, Literal, Optional
+from functools import lru_cache
+from contextvars import ContextVar
+import json
+import random
 import uuid
-from datetime import datetime, timezone, timedelta
+from string import Template
+from urllib.parse import quote
+import gzip
+from collections import OrderedDict, deque
+from datetime import date, datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 import jwt
 import bcrypt
 
+try:
+    import brotli
+except ImportError:  # optional - without it responses are gzip only
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # optional - falls back to the stdlib encoder
+    orjson = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -20,27 +44,130 @@ load_dotenv(ROOT_DIR / '.env')
 mongo_url = os.environ.get('MONGO_URL')
 db_name = os.environ.get('DB_NAME', 'maizul')
 
+# Short timeouts so an unreachable Mongo turns into a fast 503 instead of a hung request
+DB_TIMEOUT_MS = int(os.environ.get('DB_TIMEOUT_MS', '5000'))
+DB_RETRY_BASE_SECONDS = float(os.environ.get('DB_RETRY_BASE_SECONDS', '0.5'))
+DB_RETRY_MAX_SECONDS = float(os.environ.get('DB_RETRY_MAX_SECONDS', '30'))
+
 # Initialize client with connection timeout settings for better reliability
 client = None
 db = None
+db_ready = False
+db_last_error = None
+_db_connect_task = None
+_first_boot_done = False
+# pymongo errors meaning "database unreachable" - filled in by init_db once motor is imported
+DB_UNAVAILABLE_ERRORS = ()
 
 async def init_db():
-    global client, db
+    global client, db, db_ready, DB_UNAVAILABLE_ERRORS
+    if not mongo_url:
+        raise Exception("MONGO_URL not configured")
     if client is None:
-        if not mongo_url:
-            raise Exception("MONGO_URL not configured")
+        # motor/pymongo are the heaviest imports of the app, load them on first connect
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from pymongo.errors import ConnectionFailure
+        DB_UNAVAILABLE_ERRORS = (ConnectionFailure,)
         client = AsyncIOMotorClient(
             mongo_url,
-            serverSelectionTimeoutMS=10000,
-            connectTimeoutMS=10000,
+            serverSelectionTimeoutMS=DB_TIMEOUT_MS,
+            connectTimeoutMS=DB_TIMEOUT_MS,
             socketTimeoutMS=10000
         )
         db = client[db_name]
-        # Test connection
-        await client.admin.command('ping')
+    # Test connection
+    await client.admin.command('ping')
+    if not db_ready:
         logging.info("MongoDB connected successfully")
+    db_ready = True
     return db
 
+async def run_first_boot():
+    """Seed, migrate and index; every step is idempotent so a failed boot can simply run again"""
+    # Auto-seed on first connection
+    existing_admin = await db.users.find_one({"role": "admin"})
+    if not existing_admin:
+        logging.info("No admin found, seeding database...")
+        await seed_database()
+    await migrate_locations()
+    await ensure_menu_baseline()
+    for location_id in LOCATION_IDS:
+        await precompute_slots(location_id)
+
+async def connect_db_with_backoff():
+    """Ping MongoDB and run first-boot seeding, retrying both with exponential backoff"""
+    global db_last_error, _first_boot_done
+    delay = DB_RETRY_BASE_SECONDS
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            await init_db()
+        except Exception as e:
+            db_last_error = str(e)
+            if not mongo_url:
+                logging.error("MONGO_URL not configured - running without database")
+                return
+            logging.warning(f"MongoDB not ready (attempt {attempt}): {e} - retrying in {delay:.1f}s")
+        else:
+            db_last_error = None
+            if _first_boot_done:
+                return
+            try:
+                await run_first_boot()
+                _first_boot_done = True
+                return
+            except Exception as e:
+                logging.error(f"First-boot setup failed (attempt {attempt}): {e} - retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, DB_RETRY_MAX_SECONDS)
+
+def schedule_db_connect():
+    """Start the background connect loop unless one is already running"""
+    global _db_connect_task
+    if _db_connect_task is None or _db_connect_task.done():
+        _db_connect_task = asyncio.create_task(connect_db_with_backoff())
+    return _db_connect_task
+
+def mark_db_unavailable(error: Exception):
+    """Flip routes to fast 503s and reconnect in the background"""
+    global db_ready, db_last_error
+    if db_ready:
+        logging.error(f"Lost MongoDB connection: {error}")
+    db_ready = False
+    db_last_error = str(error)
+    schedule_db_connect()
+
+async def require_db():
+    if not db_ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Database unavailable, please retry shortly",
+            headers={"Retry-After": "5"}
+        )
+
+DUPLICATE_KEY_ERROR = 11000
+
+async def insert_many_idempotent(collection, documents: List[dict]):
+    """Unordered insert_many that is safe to retry with the same documents: insert_many
+    stamps each one with an `_id`, so rows that landed on an earlier attempt come back as
+    duplicate key errors and count as written"""
+    from pymongo.errors import BulkWriteError
+    try:
+        await collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if e.details.get("writeConcernErrors") or any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+            raise
+
+# Locations served by this deployment; documents without a location_id belong to the default
+DEFAULT_LOCATION_ID = os.environ.get('DEFAULT_LOCATION_ID', 'nuevo-vallarta')
+# Every other location is a 404, so a typo or a made-up slug never becomes a tenant
+LOCATION_IDS = frozenset(
+    [DEFAULT_LOCATION_ID] + [loc.strip() for loc in os.environ.get('LOCATION_IDS', '').split(',') if loc.strip()]
+)
+LOCATION_ID_PATTERN = r"^[a-z0-9][a-z0-9-]{0,63}$"
+
 # JWT Config
 JWT_SECRET = os.environ.get('JWT_SECRET', 'maizul-secret-key-change-in-production')
 JWT_ALGORITHM = "HS256"
@@ -49,11 +176,22 @@ JWT_EXPIRATION_HOURS = 24
 # Security
 security = HTTPBearer()
 
+def dump_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed"""
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
 # Create the main app
-app = FastAPI(title="Maizul Restaurant API")
+app = FastAPI(title="Maizul Restaurant API", default_response_class=FastJSONResponse)
 
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+# Create a router with the /api prefix - every route in it needs the database
+api_router = APIRouter(prefix="/api", dependencies=[Depends(require_db)])
 
 # ================== MODELS ==================
 
@@ -123,9 +261,463 @@ class MenuItemUpdate(BaseModel):
 class MenuItem(MenuItemBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    location_id: str = DEFAULT_LOCATION_ID
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
+class MenuRevision(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    seq: int
+    item_id: str
+    location_id: str = DEFAULT_LOCATION_ID
+    op: str  # create, update, delete, restore, reorder, rollback
+    changes: dict
+    actor: Optional[str] = None
+    at: str
+
+class MenuRollbackRequest(BaseModel):
+    seq: Optional[int] = Field(None, ge=0)
+    at: Optional[str] = None
+
+class MenuEvent(BaseModel):
+    type: Literal["view", "click"]
+    item_id: str = Field(max_length=64)
+    location_id: str = Field(DEFAULT_LOCATION_ID, pattern=LOCATION_ID_PATTERN)
+    session_id: Optional[str] = Field(None, max_length=64)
+    ts: Optional[str] = Field(None, max_length=40)  # client time, server time is kept separately
+
+class MenuEventBatch(BaseModel):
+    events: List[MenuEvent] = Field(min_length=1, max_length=100)
+
+class PopularItem(BaseModel):
+    item_id: str
+    location_id: str
+    views: int = 0
+    clicks: int = 0
+    score: float = 0
+
+RESERVATION_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+RESERVATION_TIME_PATTERN = r"^\d{2}:\d{2}$"
+
+class ReservationCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=80)
+    phone: str = Field(min_length=6, max_length=30)
+    party_size: int = Field(ge=1, le=20)
+    date: str = Field(pattern=RESERVATION_DATE_PATTERN)
+    time: str = Field(pattern=RESERVATION_TIME_PATTERN)
+    notes: Optional[str] = Field(None, max_length=500)
+    language: str = "es"  # es or en
+
+class Reservation(ReservationCreate):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    location_id: str = DEFAULT_LOCATION_ID
+    status: str = "confirmed"  # confirmed or cancelled
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+class SlotAvailability(BaseModel):
+    time: str
+    remaining: int
+    available: bool
+
+class WhatsAppCartItem(BaseModel):
+    item_id: str
+    quantity: int = Field(1, ge=1, le=50)
+
+class WhatsAppReservation(BaseModel):
+    name: str = Field(max_length=80)
+    date: str = Field(pattern=RESERVATION_DATE_PATTERN)
+    time: str = Field(pattern=RESERVATION_TIME_PATTERN)
+    party_size: int = Field(ge=1, le=20)
+    notes: Optional[str] = Field(None, max_length=500)
+
+class WhatsAppRenderRequest(BaseModel):
+    language: Literal["es", "en"] = "es"
+    items: List[WhatsAppCartItem] = Field([], max_length=50)
+    reservation: Optional[WhatsAppReservation] = None
+
+class WhatsAppMessage(BaseModel):
+    language: str
+    template_version: int
+    message: str
+    url: str
+
+class AuditEvent(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    at: str
+    actor: str
+    actor_id: str
+    method: str
+    route: str
+    path: str
+    status: int
+    latency_ms: float
+    diff: dict = {}
+
+class MenuHistoryResponse(BaseModel):
+    location_id: str
+    seq: int
+    at: Optional[str] = None
+    items: List[MenuItem]
+
+# ================== COMPRESSION ==================
+# CompressionMiddleware negotiates br/gzip once per request and compresses buffered
+# bodies above COMPRESSION_MIN_SIZE. Handlers serving the same payload many times can
+# return a PrecompressedResponse built with precompress(); it carries every encoding
+# already and the middleware passes it through untouched.
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '500'))
+COMPRESSION_SKIP_TYPES = (
+    "image/", "video/", "audio/", "font/woff", "application/zip", "application/gzip",
+    "application/x-gzip", "application/pdf", "application/octet-stream",
+)
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+# On-the-fly levels favour CPU; precomputed bodies are compressed once per menu change, so
+# they trade a little more CPU for ratio (brotli 10-11 would cost tens of ms per fill)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+PRECOMPRESS_GZIP_LEVEL = 9
+PRECOMPRESS_BROTLI_QUALITY = 9
+ENCODING_SCOPE_KEY = "maizul.encoding"
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Best supported encoding from an Accept-Encoding header, or None"""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        params = params.strip()
+        q = 1.0
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    for encoding in SUPPORTED_ENCODINGS:
+        if offered.get(encoding, offered.get("*", 0)) > 0:
+            return encoding
+    return None
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY if level is None else level)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL if level is None else level, mtime=0)
+
+def precompress(body: bytes) -> dict:
+    """Every supported encoding of a body at a high ratio, for payloads served many times"""
+    encoded = {"identity": body}
+    if len(body) >= COMPRESSION_MIN_SIZE:
+        for encoding in SUPPORTED_ENCODINGS:
+            level = PRECOMPRESS_BROTLI_QUALITY if encoding == "br" else PRECOMPRESS_GZIP_LEVEL
+            encoded[encoding] = compress(body, encoding, level)
+    return encoded
+
+class PrecompressedResponse(Response):
+    """JSON response that picks a precomputed encoding instead of compressing per request"""
+    media_type = "application/json"
+
+    def __init__(self, encoded: dict, **kwargs):
+        self.encoded = encoded
+        super().__init__(content=encoded["identity"], **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        if ENCODING_SCOPE_KEY in scope:
+            encoding = scope[ENCODING_SCOPE_KEY]
+        else:
+            encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding in self.encoded:
+            self.body = self.encoded[encoding]
+            self.headers["content-encoding"] = encoding
+            self.headers["content-length"] = str(len(self.body))
+        if len(self.encoded) > 1:
+            self.headers["vary"] = "Accept-Encoding"
+        await super().__call__(scope, receive, send)
+
+class CompressionMiddleware:
+    """gzip/brotli for single-body responses; streamed bodies are passed through as-is"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        scope[ENCODING_SCOPE_KEY] = encoding
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            passthrough = True
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            if (message.get("more_body", False)
+                    or len(body) < self.minimum_size
+                    or "content-encoding" in headers
+                    or headers.get("content-type", "").startswith(COMPRESSION_SKIP_TYPES)):
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            if len(compressed) < len(body):
+                body = compressed
+                headers["content-encoding"] = encoding
+                headers["content-length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+# ================== MENU CACHE ==================
+# Encoded /api/menu bodies (and the item index used by WhatsApp rendering) per
+# location. A menu mutation drops only its location's
+# entries; whole locations are evicted least-recently-used once the cache goes over
+# MENU_CACHE_MAX_BYTES, so memory stays bounded however many locations there are.
+# A location over MENU_CACHE_MAX_KEYS_PER_LOCATION evicts its oldest key.
+
+MENU_CACHE_MAX_BYTES = int(os.environ.get('MENU_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+MENU_CACHE_MAX_KEYS_PER_LOCATION = 32
+# Bookkeeping charged per entry, so many tiny (e.g. empty) menus still fill the budget
+MENU_CACHE_ENTRY_OVERHEAD = 512
+
+def encoded_size(encoded: dict) -> int:
+    return sum(len(body) for body in encoded.values())
+
+class TenantMenuCache:
+    """Per-location LRU of encoded menu bodies and other menu-derived values under a byte budget"""
+
+    def __init__(self, max_bytes: int = MENU_CACHE_MAX_BYTES,
+                 max_keys_per_location: int = MENU_CACHE_MAX_KEYS_PER_LOCATION):
+        self.max_bytes = max_bytes
+        self.max_keys_per_location = max_keys_per_location
+        self.size_bytes = 0
+        self._locations = OrderedDict()
+        self._versions = {}
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def version(self, location_id: str) -> int:
+        return self._versions.get(location_id, 0)
+
+    def get(self, location_id: str, key) -> Optional[dict]:
+        entries = self._locations.get(location_id)
+        if entries is None or key not in entries:
+            return None
+        self._locations.move_to_end(location_id)
+        return entries[key][0]
+
+    def put(self, location_id: str, key, version: int, value, size: Optional[int] = None):
+        """Cache a value unless the location's menu changed while it was being built.
+        `size` defaults to the byte size of an encoded body (see precompress)."""
+        if size is None:
+            size = encoded_size(value)
+        size += MENU_CACHE_ENTRY_OVERHEAD
+        if version != self.version(location_id):
+            return
+        entries = self._locations.get(location_id)
+        if entries is None:
+            entries = self._locations[location_id] = {}
+        elif key not in entries and len(entries) >= self.max_keys_per_location:
+            _, oldest_size = entries.pop(next(iter(entries)))
+            self.size_bytes -= oldest_size
+        self._locations.move_to_end(location_id)
+
+        if key in entries:
+            self.size_bytes -= entries[key][1]
+        entries[key] = (value, size)
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes and len(self._locations) > 1:
+            self._drop(next(iter(self._locations)))
+
+    def invalidate(self, location_id: str):
+        self._versions[location_id] = self.version(location_id) + 1
+        self._drop(location_id)
+
+    def clear(self):
+        for location_id in list(self._locations):
+            self.invalidate(location_id)
+
+    def _drop(self, location_id: str):
+        entries = self._locations.pop(location_id, None)
+        if entries:
+            self.size_bytes -= sum(size for _, size in entries.values())
+
+menu_cache = TenantMenuCache()
+
+# ================== TRUSTED READS ==================
+# Documents we wrote ourselves already match their response model, so hot read routes
+# project exactly the model's fields in Mongo, fill static defaults and hand the dicts
+# to dump_json - no pydantic validation and no response_model pass. A SCHEMA_SAMPLE_RATE
+# fraction of reads is still validated to catch schema drift.
+# (model_construct was measured slower than this, see benchmark.py serialization.)
+
+SCHEMA_SAMPLE_RATE = float(os.environ.get('SCHEMA_SAMPLE_RATE', '0.01'))
+schema_drift_count = 0
+
+@lru_cache(maxsize=None)
+def response_projection(model) -> dict:
+    """Mongo projection returning exactly the fields of a response model"""
+    projection = {name: 1 for name in model.model_fields}
+    projection["_id"] = 0
+    return projection
+
+@lru_cache(maxsize=None)
+def static_defaults(model) -> dict:
+    return {
+        name: field.default for name, field in model.model_fields.items()
+        if not field.is_required() and field.default_factory is None
+    }
+
+def check_schema(model, rows: List[dict], trusted: List[dict]):
+    """Validate rows and log any that the trusted path would serve differently"""
+    global schema_drift_count
+    for row, fast in zip(rows, trusted):
+        try:
+            drifted = model.model_validate(row).model_dump(mode="json") != fast
+        except ValidationError as e:
+            drifted = e
+        if drifted:
+            schema_drift_count += 1
+            logging.error(f"Schema drift in {model.__name__} row {row.get('id')}: {drifted}")
+
+def trusted_rows(model, rows: List[dict]) -> List[dict]:
+    """Rows fetched with response_projection(model), ready for dump_json"""
+    defaults = static_defaults(model)
+    trusted = [row if defaults.keys() <= row.keys() else {**defaults, **row} for row in rows]
+    if random.random() < SCHEMA_SAMPLE_RATE:
+        check_schema(model, rows, trusted)
+    return trusted
+
+# ================== AUDIT LOG ==================
+# AuditMiddleware opens an audit event for every mutating request; get_current_user
+# fills in the actor and handlers attach what they changed with audit_change(). Events
+# of authenticated requests are queued and a background task writes them in batches
+# to the capped `audit_log` collection (and one JSON line each to the "maizul.audit"
+# logger), so the request only pays for a dict and a put_nowait.
+
+AUDIT_LOG_MAX_BYTES = int(os.environ.get('AUDIT_LOG_MAX_BYTES', str(64 * 1024 * 1024)))
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_BATCH_SIZE = 200
+AUDIT_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+SENSITIVE_FIELDS = {"password", "password_hash"}
+
+audit_logger = logging.getLogger("maizul.audit")
+if not audit_logger.handlers:
+    # One JSON object per line, without the root handler's "time - name - level" prefix
+    _audit_handler = logging.StreamHandler()
+    _audit_handler.setFormatter(logging.Formatter("%(message)s"))
+    audit_logger.addHandler(_audit_handler)
+    audit_logger.setLevel(logging.INFO)
+    audit_logger.propagate = False
+audit_queue: asyncio.Queue = asyncio.Queue(maxsize=AUDIT_QUEUE_SIZE)
+audit_context: ContextVar[Optional[dict]] = ContextVar("audit_context", default=None)
+audit_dropped = 0
+_audit_log_ready = False
+
+def audit(**fields):
+    """Add fields to the current request's audit event (no-op outside mutating requests)"""
+    event = audit_context.get()
+    if event is not None:
+        event.update(fields)
+
+def audit_change(target_id: str, changes: dict):
+    event = audit_context.get()
+    if event is not None:
+        event.setdefault("diff", {})[target_id] = {
+            k: "***" if k in SENSITIVE_FIELDS else v for k, v in changes.items()
+        }
+
+class AuditMiddleware:
+    """Times mutating requests and queues an audit event when an authenticated user made them"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in AUDIT_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        event = {}
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = audit_context.set(event)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            audit_context.reset(token)
+            if "actor" in event:
+                route = scope.get("route")
+                event.update(
+                    at=datetime.now(timezone.utc).isoformat(),
+                    method=scope["method"],
+                    route=getattr(route, "path", scope["path"]),
+                    path=scope["path"],
+                    status=status_code,
+                    latency_ms=round((time.perf_counter() - started) * 1000, 3),
+                )
+                queue_audit_event(event)
+
+def queue_audit_event(event: dict):
+    global audit_dropped
+    try:
+        audit_queue.put_nowait(event)
+    except asyncio.QueueFull:
+        audit_dropped += 1
+
+async def ensure_audit_log():
+    global _audit_log_ready
+    if "audit_log" not in await db.list_collection_names():
+        await db.create_collection("audit_log", capped=True, size=AUDIT_LOG_MAX_BYTES)
+    await db.audit_log.create_index([("actor", 1), ("at", -1)])
+    await db.audit_log.create_index("at")
+    _audit_log_ready = True
+
+async def audit_writer():
+    """Drain the audit queue into the capped collection in batches"""
+    while True:
+        batch = [await audit_queue.get()]
+        while len(batch) < AUDIT_BATCH_SIZE and not audit_queue.empty():
+            batch.append(audit_queue.get_nowait())
+        for event in batch:
+            audit_logger.info(dump_json(event).decode("utf-8"))
+        while True:
+            try:
+                if not _audit_log_ready:
+                    await ensure_audit_log()
+                # A retry after a partial write skips the events that landed (same _ids)
+                await insert_many_idempotent(db.audit_log, batch)
+                break
+            except Exception as e:
+                logging.error(f"Writing {len(batch)} audit events failed: {e} - retrying")
+                await asyncio.sleep(DB_RETRY_BASE_SECONDS * 4)
+        for _ in batch:
+            audit_queue.task_done()
+
 # ================== AUTH HELPERS ==================
 
 def hash_password(password: str) -> str:
@@ -156,6 +748,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
     if not user or not user.get("is_active"):
         raise HTTPException(status_code=401, detail="User not found or inactive")
+    audit(actor=user["username"], actor_id=user["id"])
     return user
 
 async def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
@@ -163,6 +756,153 @@ async def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
+# ================== MENU REVISIONS ==================
+# Every menu mutation appends a field-level diff to `menu_revisions` ({location_id, seq,
+# item_id, op, changes, actor, at}); replaying the `changes` of an item in seq order
+# rebuilds it. Seqs come from one global counter, so a location's seqs have gaps.
+# Every MENU_SNAPSHOT_EVERY revisions of a location, a full copy of that location's menu
+# goes to `menu_snapshots`, so a point-in-time rebuild replays at most that many revisions
+# and never reads another location's history.
+# Revisions are queued and written by a background task, off the admin save path.
+
+MENU_SNAPSHOT_EVERY = int(os.environ.get('MENU_SNAPSHOT_EVERY', '50'))
+REVISION_BATCH_SIZE = 100
+# How long a rollback waits for queued revisions to reach Mongo before giving up with a 503
+REVISION_FLUSH_TIMEOUT_SECONDS = float(os.environ.get('REVISION_FLUSH_TIMEOUT_SECONDS', '10'))
+
+revision_queue: asyncio.Queue = asyncio.Queue()
+
+def diff_fields(before: dict, after: dict) -> dict:
+    """Fields of `after` that differ from `before`"""
+    return {k: v for k, v in after.items() if k != "_id" and before.get(k) != v}
+
+def record_revision(location_id: str, item_id: str, op: str, changes: dict, actor: Optional[str] = None):
+    """Queue a revision - never blocks the request. Every menu mutation goes through here."""
+    if changes:
+        menu_cache.invalidate(location_id)
+        audit_change(item_id, changes)
+        revision_queue.put_nowait({
+            "location_id": location_id,
+            "item_id": item_id,
+            "op": op,
+            "changes": changes,
+            "actor": actor,
+            "at": datetime.now(timezone.utc).isoformat()
+        })
+
+def parse_timestamp(value: Optional[str], field: str) -> Optional[str]:
+    """ISO 8601 input as a UTC isoformat string, comparable with the stored `at` values"""
+    if value is None:
+        return None
+    try:
+        if value.endswith(("Z", "z")):
+            value = value[:-1] + "+00:00"
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {field}, expected an ISO 8601 timestamp")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+def apply_revision(state: dict, revision: dict):
+    state[revision["item_id"]] = {**state.get(revision["item_id"], {}), **revision["changes"]}
+
+async def rebuild_menu(location_id: str, seq: Optional[int] = None, at: Optional[str] = None):
+    """A location's menu state (including soft-deleted items) as of a revision seq or timestamp"""
+    bounds = {"location_id": location_id}
+    if seq is not None:
+        bounds["seq"] = {"$lte": seq}
+    if at is not None:
+        bounds["at"] = {"$lte": at}
+
+    snapshot = await db.menu_snapshots.find_one(bounds, {"_id": 0}, sort=[("seq", -1)])
+    state = {item["id"]: item for item in snapshot["items"]} if snapshot else {}
+    last_seq = snapshot["seq"] if snapshot else 0
+
+    rev_query = dict(bounds)
+    rev_query["seq"] = {**bounds.get("seq", {}), "$gt": last_seq}
+    replayed = 0
+    async for revision in db.menu_revisions.find(rev_query, {"_id": 0}).sort("seq", 1):
+        apply_revision(state, revision)
+        last_seq = revision["seq"]
+        replayed += 1
+    if snapshot is None and not replayed and (seq is not None or at is not None):
+        # Before the history starts: an empty state here would read as "every item deleted"
+        raise HTTPException(status_code=404, detail="No menu history at or before the requested version")
+    return state, last_seq
+
+async def migrate_locations():
+    """Assign pre multi-location documents to the default location and index by location first"""
+    await db.menu_items.update_many(
+        {"location_id": {"$exists": False}}, {"$set": {"location_id": DEFAULT_LOCATION_ID}}
+    )
+    await db.menu_items.create_index([("location_id", 1), ("category", 1), ("sort_order", 1)])
+    await db.menu_items.create_index([("location_id", 1), ("sort_order", 1)])
+    await db.menu_items.create_index([("location_id", 1), ("id", 1)])
+    await db.menu_item_stats.create_index([("location_id", 1), ("item_id", 1)], unique=True)
+    await db.menu_item_stats.create_index([("location_id", 1), ("score", -1)])
+
+async def ensure_menu_baseline():
+    """Revision indexes, plus a seq 0 snapshot per location so items that predate the log can be rebuilt"""
+    await db.menu_revisions.create_index("seq", unique=True)
+    await db.menu_revisions.create_index([("location_id", 1), ("seq", 1)])
+    await db.menu_revisions.create_index([("location_id", 1), ("item_id", 1), ("seq", -1)])
+    await db.menu_snapshots.create_index([("location_id", 1), ("seq", 1)], unique=True)
+    for location_id in await db.menu_items.distinct("location_id"):
+        if not await db.menu_snapshots.find_one({"location_id": location_id, "seq": 0}, {"_id": 1}):
+            items = await db.menu_items.find({"location_id": location_id}, {"_id": 0}).to_list(None)
+            await db.menu_snapshots.insert_one({
+                "location_id": location_id, "seq": 0, "at": datetime.now(timezone.utc).isoformat(), "items": items
+            })
+
+async def _write_revisions(batch: List[dict]):
+    # Seqs (and the `_id`s insert_many adds) stay on the revisions across retries, so a
+    # retry after a partial write rewrites the same rows instead of duplicating them
+    if "seq" not in batch[0]:
+        counter = await db.counters.find_one_and_update(
+            {"_id": "menu_revisions"}, {"$inc": {"seq": len(batch)}}, upsert=True, return_document=True
+        )
+        first_seq = counter["seq"] - len(batch) + 1
+        for offset, revision in enumerate(batch):
+            revision["seq"] = first_seq + offset
+    await insert_many_idempotent(db.menu_revisions, batch)
+
+async def _snapshot_menus(batch: List[dict]):
+    latest = {revision["location_id"]: revision for revision in batch}
+    for location_id, revision in latest.items():
+        snapshot = await db.menu_snapshots.find_one(
+            {"location_id": location_id}, {"_id": 0, "seq": 1}, sort=[("seq", -1)]
+        )
+        since = await db.menu_revisions.count_documents({
+            "location_id": location_id, "seq": {"$gt": snapshot["seq"] if snapshot else 0, "$lte": revision["seq"]}
+        })
+        if since >= MENU_SNAPSHOT_EVERY:
+            state, _ = await rebuild_menu(location_id, seq=revision["seq"])
+            await insert_many_idempotent(db.menu_snapshots, [{
+                "location_id": location_id, "seq": revision["seq"], "at": revision["at"], "items": list(state.values())
+            }])
+
+async def revision_writer():
+    """Drain the revision queue into Mongo in batches, retrying while the DB is away"""
+    while True:
+        batch = [await revision_queue.get()]
+        while len(batch) < REVISION_BATCH_SIZE and not revision_queue.empty():
+            batch.append(revision_queue.get_nowait())
+        while True:
+            try:
+                await _write_revisions(batch)
+                break
+            except Exception as e:
+                logging.error(f"Writing {len(batch)} menu revisions failed: {e} - retrying")
+                await asyncio.sleep(DB_RETRY_BASE_SECONDS * 4)
+        try:
+            await _snapshot_menus(batch)
+        except Exception as e:
+            # Only a shortcut for rebuilds - the next boundary takes a fresh one
+            logging.warning(f"Menu snapshot at seq {batch[-1]['seq']} failed: {e}")
+        for _ in batch:
+            revision_queue.task_done()
+
 # ================== AUTH ROUTES ==================
 
 @api_router.post("/auth/login", response_model=TokenResponse)
@@ -203,8 +943,8 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 
 @api_router.get("/users", response_model=List[UserResponse])
 async def get_users(admin: dict = Depends(require_admin)):
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(100)
-    return [UserResponse(**u) for u in users]
+    users = await db.users.find({}, response_projection(UserResponse)).to_list(100)
+    return FastJSONResponse(trusted_rows(UserResponse, users))
 
 @api_router.post("/users", response_model=UserResponse, status_code=201)
 async def create_user(user_data: UserCreate, admin: dict = Depends(require_admin)):
@@ -217,6 +957,7 @@ async def create_user(user_data: UserCreate, admin: dict = Depends(require_admin
     doc["password_hash"] = hash_password(user_data.password)
     
     await db.users.insert_one(doc)
+    audit_change(user.id, user.model_dump())
     return UserResponse(**doc)
 
 @api_router.put("/users/{user_id}", response_model=UserResponse)
@@ -231,6 +972,7 @@ async def update_user(user_id: str, user_data: UserUpdate, admin: dict = Depends
     
     if update_data:
         await db.users.update_one({"id": user_id}, {"$set": update_data})
+        audit_change(user_id, diff_fields(existing, update_data))
     
     updated = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
     return UserResponse(**updated)
@@ -243,67 +985,674 @@ async def delete_user(user_id: str, admin: dict = Depends(require_admin)):
     result = await db.users.delete_one({"id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    audit_change(user_id, {"deleted": True})
 
 # ================== MENU ROUTES ==================
 
-@api_router.get("/menu", response_model=List[MenuItem])
-async def get_menu(category: Optional[str] = None, available_only: bool = True):
-    query = {}
+async def get_location_id(location_id: str = Query(DEFAULT_LOCATION_ID, pattern=LOCATION_ID_PATTERN)) -> str:
+    if location_id not in LOCATION_IDS:
+        raise HTTPException(status_code=404, detail="Unknown location")
+    return location_id
+
+MENU_CATEGORIES = ("breakfast", "lunch", "dinner")
+
+# In-flight cache fills keyed by (location_id, cache key, cache version)
+menu_fills = {}
+
+async def menu_body(category: Optional[str], available_only: bool, location_id: str) -> bytes:
+    query = {"location_id": location_id, "deleted_at": None}
     if category:
         query["category"] = category
     if available_only:
         query["is_available"] = True
     
-    items = await db.menu_items.find(query, {"_id": 0}).sort("sort_order", 1).to_list(500)
-    return [MenuItem(**item) for item in items]
+    items = await db.menu_items.find(query, response_projection(MenuItem)).sort("sort_order", 1).to_list(500)
+    return dump_json(trusted_rows(MenuItem, items))
+
+async def fill_menu_cache(category: Optional[str], available_only: bool, location_id: str, version: int) -> dict:
+    body = await menu_body(category, available_only, location_id)
+    # High-ratio brotli takes milliseconds, keep it off the event loop
+    encoded = await asyncio.to_thread(precompress, body)
+    menu_cache.put(location_id, (category, available_only), version, encoded)
+    return encoded
+
+@api_router.get("/menu", response_model=List[MenuItem], response_class=PrecompressedResponse)
+async def get_menu(category: Optional[str] = None, available_only: bool = True, location_id: str = Depends(get_location_id)):
+    if category is not None and category not in MENU_CATEGORIES:
+        # Not cached, so arbitrary category strings cannot push real menus out of the cache
+        return Response(await menu_body(category, available_only, location_id), media_type="application/json")
+    cache_key = (category, available_only)
+    encoded = menu_cache.get(location_id, cache_key)
+    if encoded is None:
+        version = menu_cache.version(location_id)
+        # Concurrent misses for the same menu version share one query and compression
+        fill_key = (location_id, cache_key, version)
+        fill = menu_fills.get(fill_key)
+        if fill is None:
+            fill = menu_fills[fill_key] = asyncio.ensure_future(
+                fill_menu_cache(category, available_only, location_id, version)
+            )
+            fill.add_done_callback(lambda _: menu_fills.pop(fill_key, None))
+        # Shielded: a client hanging up must not cancel the fill the others are waiting on
+        encoded = await asyncio.shield(fill)
+    return PrecompressedResponse(encoded)
+
+@api_router.get("/menu/history", response_model=MenuHistoryResponse)
+async def get_menu_history(seq: Optional[int] = Query(None, ge=0), at: Optional[str] = None, location_id: str = Depends(get_location_id),
+                           current_user: dict = Depends(get_current_user)):
+    """Menu as it was at a revision seq or ISO timestamp (latest if neither is given)"""
+    at = parse_timestamp(at, "at")
+    state, last_seq = await rebuild_menu(location_id, seq=seq, at=at)
+    items = sorted(
+        (item for item in state.values() if not item.get("deleted_at")),
+        key=lambda item: (item.get("category", ""), item.get("sort_order", 0))
+    )
+    return MenuHistoryResponse(location_id=location_id, seq=last_seq, at=at, items=[MenuItem(**item) for item in items])
+
+@api_router.post("/menu/rollback", response_model=dict)
+async def rollback_menu(request: MenuRollbackRequest, location_id: str = Depends(get_location_id),
+                        admin: dict = Depends(require_admin)):
+    """Restore a location's live menu to a historical version, logging each change as a revision"""
+    if request.seq is None and request.at is None:
+        raise HTTPException(status_code=400, detail="seq or at is required")
+    at = parse_timestamp(request.at, "at")
+    try:
+        # Make sure the log is complete before reading it
+        await asyncio.wait_for(revision_queue.join(), REVISION_FLUSH_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="Menu history is still being saved, please retry shortly",
+            headers={"Retry-After": "5"}
+        )
+    target, target_seq = await rebuild_menu(location_id, seq=request.seq, at=at)
+    current_items = await db.menu_items.find({"location_id": location_id}, {"_id": 0}).to_list(None)
+    current = {item["id"]: item for item in current_items}
+    now = datetime.now(timezone.utc).isoformat()
+
+    changed = 0
+    for item_id in target.keys() | current.keys():
+        wanted = target.get(item_id)
+        existing = current.get(item_id, {})
+        if wanted is None:
+            # Created after the target version
+            changes = {} if existing.get("deleted_at") else {"deleted_at": now}
+        else:
+            changes = diff_fields(existing, {**wanted, "location_id": location_id, "deleted_at": wanted.get("deleted_at")})
+        if changes:
+            changes["updated_at"] = now
+            await db.menu_items.update_one({"id": item_id, "location_id": location_id}, {"$set": changes}, upsert=True)
+            record_revision(location_id, item_id, "rollback", changes, admin["username"])
+            changed += 1
+    return {"message": "Menu rolled back", "location_id": location_id, "seq": target_seq, "items_changed": changed}
+
+@api_router.get("/menu/{item_id}/revisions", response_model=List[MenuRevision])
+async def get_menu_item_revisions(item_id: str, location_id: str = Depends(get_location_id),
+                                  current_user: dict = Depends(get_current_user)):
+    revisions = await db.menu_revisions.find(
+        {"location_id": location_id, "item_id": item_id}, {"_id": 0}
+    ).sort("seq", -1).to_list(200)
+    return [MenuRevision(**r) for r in revisions]
 
 @api_router.get("/menu/{item_id}", response_model=MenuItem)
-async def get_menu_item(item_id: str):
-    item = await db.menu_items.find_one({"id": item_id}, {"_id": 0})
+async def get_menu_item(item_id: str, location_id: str = Depends(get_location_id)):
+    item = await db.menu_items.find_one(
+        {"location_id": location_id, "id": item_id, "deleted_at": None}, response_projection(MenuItem)
+    )
     if not item:
         raise HTTPException(status_code=404, detail="Menu item not found")
-    return MenuItem(**item)
+    return FastJSONResponse(trusted_rows(MenuItem, [item])[0])
 
 @api_router.post("/menu", response_model=MenuItem, status_code=201)
-async def create_menu_item(item_data: MenuItemCreate, current_user: dict = Depends(get_current_user)):
-    item = MenuItem(**item_data.model_dump())
+async def create_menu_item(item_data: MenuItemCreate, location_id: str = Depends(get_location_id),
+                           current_user: dict = Depends(get_current_user)):
+    item = MenuItem(**item_data.model_dump(), location_id=location_id)
     doc = item.model_dump()
     await db.menu_items.insert_one(doc)
+    record_revision(location_id, item.id, "create", item.model_dump(), current_user["username"])
     return item
 
+# Declared before /menu/{item_id} so "reorder" is not captured as an item id
+@api_router.put("/menu/reorder", response_model=dict)
+async def reorder_menu_items(items: List[dict], location_id: str = Depends(get_location_id),
+                             current_user: dict = Depends(get_current_user)):
+    """Update sort order for multiple items. Expects [{id: str, sort_order: int}]"""
+    for item in items:
+        changes = {"sort_order": item["sort_order"], "updated_at": datetime.now(timezone.utc).isoformat()}
+        result = await db.menu_items.update_one({"location_id": location_id, "id": item["id"]}, {"$set": changes})
+        if result.matched_count:
+            record_revision(location_id, item["id"], "reorder", changes, current_user["username"])
+    return {"message": "Order updated successfully"}
+
 @api_router.put("/menu/{item_id}", response_model=MenuItem)
-async def update_menu_item(item_id: str, item_data: MenuItemUpdate, current_user: dict = Depends(get_current_user)):
-    existing = await db.menu_items.find_one({"id": item_id}, {"_id": 0})
+async def update_menu_item(item_id: str, item_data: MenuItemUpdate, location_id: str = Depends(get_location_id),
+                           current_user: dict = Depends(get_current_user)):
+    item_filter = {"location_id": location_id, "id": item_id}
+    existing = await db.menu_items.find_one({**item_filter, "deleted_at": None}, {"_id": 0})
     if not existing:
         raise HTTPException(status_code=404, detail="Menu item not found")
     
     update_data = {k: v for k, v in item_data.model_dump().items() if v is not None}
+    changes = diff_fields(existing, update_data)
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     if update_data:
-        await db.menu_items.update_one({"id": item_id}, {"$set": update_data})
+        await db.menu_items.update_one(item_filter, {"$set": update_data})
+    if changes:
+        changes["updated_at"] = update_data["updated_at"]
+        record_revision(location_id, item_id, "update", changes, current_user["username"])
     
-    updated = await db.menu_items.find_one({"id": item_id}, {"_id": 0})
+    updated = await db.menu_items.find_one(item_filter, {"_id": 0})
     return MenuItem(**updated)
 
 @api_router.delete("/menu/{item_id}", status_code=204)
-async def delete_menu_item(item_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.menu_items.delete_one({"id": item_id})
-    if result.deleted_count == 0:
+async def delete_menu_item(item_id: str, location_id: str = Depends(get_location_id),
+                           current_user: dict = Depends(get_current_user)):
+    """Soft delete - the item stays in the collection and its history"""
+    now = datetime.now(timezone.utc).isoformat()
+    changes = {"deleted_at": now, "updated_at": now}
+    result = await db.menu_items.update_one(
+        {"location_id": location_id, "id": item_id, "deleted_at": None}, {"$set": changes}
+    )
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Menu item not found")
+    record_revision(location_id, item_id, "delete", changes, current_user["username"])
 
-@api_router.put("/menu/reorder", response_model=dict)
-async def reorder_menu_items(items: List[dict], current_user: dict = Depends(get_current_user)):
-    """Update sort order for multiple items. Expects [{id: str, sort_order: int}]"""
+@api_router.post("/menu/{item_id}/restore", response_model=MenuItem)
+async def restore_menu_item(item_id: str, location_id: str = Depends(get_location_id),
+                            current_user: dict = Depends(get_current_user)):
+    item_filter = {"location_id": location_id, "id": item_id}
+    changes = {"deleted_at": None, "updated_at": datetime.now(timezone.utc).isoformat()}
+    result = await db.menu_items.update_one({**item_filter, "deleted_at": {"$ne": None}}, {"$set": changes})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Deleted menu item not found")
+    record_revision(location_id, item_id, "restore", changes, current_user["username"])
+    item = await db.menu_items.find_one(item_filter, {"_id": 0})
+    return MenuItem(**item)
+
+# ================== ANALYTICS ==================
+# POST /api/events appends to an in-memory buffer; a background task flushes it with
+# insert_many once EVENT_FLUSH_SIZE events are waiting or every EVENT_FLUSH_SECONDS.
+# When the buffer is full, new batches get a 429 instead of growing memory. Events for
+# items that are not on the location's (cached) menu are dropped at ingestion.
+# Each flush also $incs per-item counters in `menu_item_stats` (the popular view), and
+# with AUTO_POPULAR_TAG_COUNT > 0 the top items of each location get the "popular" tag.
+# Both writes are retried separately: a failed counter update never re-inserts events,
+# and each counter remembers the flush batches it counted, so a replayed update is a no-op.
+
+EVENT_BUFFER_CAPACITY = int(os.environ.get('EVENT_BUFFER_CAPACITY', '20000'))
+EVENT_FLUSH_SIZE = int(os.environ.get('EVENT_FLUSH_SIZE', '500'))
+EVENT_FLUSH_SECONDS = float(os.environ.get('EVENT_FLUSH_SECONDS', '5'))
+EVENT_SCORE_WEIGHTS = {"view": 1, "click": 3}
+AUTO_POPULAR_TAG_COUNT = int(os.environ.get('AUTO_POPULAR_TAG_COUNT', '0'))
+POPULAR_TAG_REFRESH_SECONDS = float(os.environ.get('POPULAR_TAG_REFRESH_SECONDS', '300'))
+
+class EventBuffer:
+    """Bounded FIFO of pending events; accepts whole batches or nothing"""
+
+    def __init__(self, capacity: int = EVENT_BUFFER_CAPACITY, flush_size: int = EVENT_FLUSH_SIZE):
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.rejected = 0
+        self._events = deque()
+        self._flush_wanted = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def offer(self, events: List[dict]) -> bool:
+        if len(self._events) + len(events) > self.capacity:
+            self.rejected += len(events)
+            return False
+        self._events.extend(events)
+        if len(self._events) >= self.flush_size:
+            self._flush_wanted.set()
+        return True
+
+    def take(self, limit: int) -> List[dict]:
+        return [self._events.popleft() for _ in range(min(limit, len(self._events)))]
+
+    def put_back(self, events: List[dict]):
+        """Return a failed flush to the front, keeping order"""
+        self._events.extendleft(reversed(events))
+
+    async def wait_for_flush(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._flush_wanted.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._flush_wanted.clear()
+
+event_buffer = EventBuffer()
+_popular_dirty_locations = set()
+# Stored batches whose counter update is not confirmed yet, as (batch_id, events)
+_unscored_batches = []
+# Batch ids remembered per counter document - far more than a retry ever lags behind
+STATS_BATCH_HISTORY = 100
+
+async def update_popular_stats(batch_id: str, events: List[dict]):
+    """Fold a flushed batch into the per-item counters, at most once per counter"""
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError
+
+    counts = {}
+    for event in events:
+        key = (event["location_id"], event["item_id"])
+        views, clicks = counts.get(key, (0, 0))
+        counts[key] = (views + (event["type"] == "view"), clicks + (event["type"] == "click"))
+    try:
+        await db.menu_item_stats.bulk_write([
+            UpdateOne(
+                {"location_id": location_id, "item_id": item_id, "batches": {"$ne": batch_id}},
+                {
+                    "$inc": {
+                        "views": views,
+                        "clicks": clicks,
+                        "score": views * EVENT_SCORE_WEIGHTS["view"] + clicks * EVENT_SCORE_WEIGHTS["click"]
+                    },
+                    "$push": {"batches": {"$each": [batch_id], "$slice": -STATS_BATCH_HISTORY}}
+                },
+                upsert=True
+            )
+            for (location_id, item_id), (views, clicks) in counts.items()
+        ], ordered=False)
+    except BulkWriteError as e:
+        # A counter that already has this batch misses the filter, and its upsert then hits
+        # the unique (location_id, item_id) index - that counter is done
+        errors = e.details.get("writeErrors", [])
+        if e.details.get("writeConcernErrors") or any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+            raise
+    _popular_dirty_locations.update(location_id for location_id, _ in counts)
+
+async def refresh_popular_tags(location_id: str):
+    """Give the top AUTO_POPULAR_TAG_COUNT items the "popular" tag and take it from the rest"""
+    top = await db.menu_item_stats.find(
+        {"location_id": location_id}, {"_id": 0, "item_id": 1}
+    ).sort("score", -1).to_list(AUTO_POPULAR_TAG_COUNT)
+    top_ids = [stat["item_id"] for stat in top]
+    now = datetime.now(timezone.utc).isoformat()
+
+    items = await db.menu_items.find(
+        {"location_id": location_id, "deleted_at": None,
+         "$or": [{"id": {"$in": top_ids}}, {"tags": "popular"}]},
+        {"_id": 0, "id": 1, "tags": 1}
+    ).to_list(None)
     for item in items:
-        await db.menu_items.update_one(
-            {"id": item["id"]},
-            {"$set": {"sort_order": item["sort_order"], "updated_at": datetime.now(timezone.utc).isoformat()}}
+        tags = item.get("tags", [])
+        if item["id"] in top_ids and "popular" not in tags:
+            tags = tags + ["popular"]
+        elif item["id"] not in top_ids and "popular" in tags:
+            tags = [tag for tag in tags if tag != "popular"]
+        else:
+            continue
+        changes = {"tags": tags, "updated_at": now}
+        await db.menu_items.update_one({"location_id": location_id, "id": item["id"]}, {"$set": changes})
+        record_revision(location_id, item["id"], "update", changes, "analytics")
+
+async def flush_events() -> int:
+    events = event_buffer.take(EVENT_FLUSH_SIZE)
+    if events:
+        try:
+            await insert_many_idempotent(db.menu_events, events)
+        except BaseException:
+            # Also on cancellation, so a batch in flight at shutdown is not lost.
+            # The events keep the _ids insert_many gave them, so the retry skips those that landed
+            event_buffer.put_back(events)
+            raise
+        _unscored_batches.append((str(uuid.uuid4()), events))
+    while _unscored_batches:
+        batch_id, scored = _unscored_batches[0]
+        await update_popular_stats(batch_id, scored)
+        _unscored_batches.pop(0)
+    return len(events)
+
+async def event_flusher():
+    """Flush on size or time; events wait in the buffer while the database is unavailable"""
+    last_tag_refresh = time.monotonic()
+    while True:
+        await event_buffer.wait_for_flush(EVENT_FLUSH_SECONDS)
+        if not db_ready:
+            continue
+        try:
+            while await flush_events() == EVENT_FLUSH_SIZE:
+                pass
+            if AUTO_POPULAR_TAG_COUNT and time.monotonic() - last_tag_refresh >= POPULAR_TAG_REFRESH_SECONDS:
+                last_tag_refresh = time.monotonic()
+                while _popular_dirty_locations:
+                    await refresh_popular_tags(_popular_dirty_locations.pop())
+        except Exception as e:
+            logging.error(f"Flushing menu events failed: {e} ({len(event_buffer)} pending)")
+
+# Registered on the app so events are buffered even while the database is unavailable
+@app.post("/api/events", status_code=202)
+async def ingest_events(batch: MenuEventBatch):
+    # Only items on the menu count, so made-up ids cannot grow the stats or earn the popular tag.
+    # The menu index is cached; a cold one with the database down answers 503.
+    menus = {}
+    for location_id in {event.location_id for event in batch.events} & LOCATION_IDS:
+        menus[location_id] = await get_menu_index(location_id)
+    received_at = datetime.now(timezone.utc).isoformat()
+    events = [
+        {**event.model_dump(), "received_at": received_at}
+        for event in batch.events if event.item_id in menus.get(event.location_id, ())
+    ]
+    if not event_buffer.offer(events):
+        raise HTTPException(
+            status_code=429,
+            detail="Event buffer full, retry later",
+            headers={"Retry-After": str(max(1, int(EVENT_FLUSH_SECONDS)))}
         )
-    return {"message": "Order updated successfully"}
+    return {"accepted": len(events), "dropped": len(batch.events) - len(events)}
+
+@api_router.get("/events/popular", response_model=List[PopularItem])
+async def get_popular_items(limit: int = Query(10, ge=1, le=100), location_id: str = Depends(get_location_id),
+                            current_user: dict = Depends(get_current_user)):
+    stats = await db.menu_item_stats.find(
+        {"location_id": location_id}, response_projection(PopularItem)
+    ).sort("score", -1).to_list(limit)
+    return FastJSONResponse(trusted_rows(PopularItem, stats))
+
+# ================== RESERVATIONS ==================
+# Capacity lives in one `reservation_slots` document per (location, date, time) holding
+# the covers still free in `remaining`. The documents are created ahead of time (or by
+# the first booking of a day), so availability is a single indexed read that never
+# writes, and a booking is one conditional update
+# ({remaining: {$gte: party}} + $inc) - Mongo applies it atomically per document, so
+# concurrent requests can never take the same covers twice.
+
+RESTAURANT_TIMEZONE = ZoneInfo(os.environ.get('RESTAURANT_TIMEZONE', 'America/Bahia_Banderas'))
+RESERVATION_OPEN_HOUR = int(os.environ.get('RESERVATION_OPEN_HOUR', '9'))
+RESERVATION_LAST_SEATING_HOUR = int(os.environ.get('RESERVATION_LAST_SEATING_HOUR', '21'))
+RESERVATION_SLOT_MINUTES = int(os.environ.get('RESERVATION_SLOT_MINUTES', '30'))
+RESERVATION_SLOT_CAPACITY = int(os.environ.get('RESERVATION_SLOT_CAPACITY', '40'))
+RESERVATION_HORIZON_DAYS = int(os.environ.get('RESERVATION_HORIZON_DAYS', '60'))
+
+RESERVATION_SLOT_TIMES = [
+    f"{minutes // 60:02d}:{minutes % 60:02d}"
+    for minutes in range(RESERVATION_OPEN_HOUR * 60, RESERVATION_LAST_SEATING_HOUR * 60 + 1, RESERVATION_SLOT_MINUTES)
+]
+
+# (location_id, date) pairs whose slot documents are known to exist
+_slot_days_ready = set()
+_slot_indexes_ready = False
+
+def parse_reservation_date(value: str) -> date:
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date")
+    today = datetime.now(RESTAURANT_TIMEZONE).date()
+    if not today <= day <= today + timedelta(days=RESERVATION_HORIZON_DAYS):
+        raise HTTPException(status_code=400, detail=f"Reservations are open for the next {RESERVATION_HORIZON_DAYS} days")
+    return day
+
+def slot_has_passed(day: date, slot_time: str) -> bool:
+    now = datetime.now(RESTAURANT_TIMEZONE)
+    return day == now.date() and slot_time <= now.strftime("%H:%M")
+
+async def ensure_slots(location_id: str, day: str):
+    """Create the day's slot documents if missing; safe to race with other workers"""
+    global _slot_indexes_ready
+    if (location_id, day) in _slot_days_ready:
+        return
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError
+
+    if not _slot_indexes_ready:
+        # The unique index is what stops two racing upserts from creating the same slot twice
+        await db.reservation_slots.create_index([("location_id", 1), ("date", 1), ("time", 1)], unique=True)
+        await db.reservations.create_index([("location_id", 1), ("date", 1), ("time", 1)])
+        _slot_indexes_ready = True
+
+    try:
+        await db.reservation_slots.bulk_write([
+            UpdateOne(
+                {"location_id": location_id, "date": day, "time": slot_time},
+                {"$setOnInsert": {"capacity": RESERVATION_SLOT_CAPACITY, "remaining": RESERVATION_SLOT_CAPACITY}},
+                upsert=True
+            )
+            for slot_time in RESERVATION_SLOT_TIMES
+        ], ordered=False)
+    except BulkWriteError as e:
+        # A concurrent upsert of the same slot loses on the unique index - the slot exists
+        if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+    _slot_days_ready.add((location_id, day))
+    if len(_slot_days_ready) > len(LOCATION_IDS) * (RESERVATION_HORIZON_DAYS + 2):
+        today = datetime.now(RESTAURANT_TIMEZONE).date().isoformat()
+        _slot_days_ready.difference_update({key for key in _slot_days_ready if key[1] < today})
+
+async def precompute_slots(location_id: str = DEFAULT_LOCATION_ID):
+    today = datetime.now(RESTAURANT_TIMEZONE).date()
+    for offset in range(RESERVATION_HORIZON_DAYS + 1):
+        await ensure_slots(location_id, (today + timedelta(days=offset)).isoformat())
+
+async def release_covers(reservation: dict):
+    await db.reservation_slots.update_one(
+        {"location_id": reservation["location_id"], "date": reservation["date"], "time": reservation["time"]},
+        {"$inc": {"remaining": reservation["party_size"]}}
+    )
+
+@api_router.get("/reservations/availability", response_model=List[SlotAvailability])
+async def get_availability(date: str, party_size: int = Query(2, ge=1, le=20),
+                           location_id: str = Depends(get_location_id)):
+    requested_day = parse_reservation_date(date)
+    day = requested_day.isoformat()
+    # Read-only: a day without slot documents yet has nothing booked, so every slot is free
+    slots = await db.reservation_slots.find(
+        {"location_id": location_id, "date": day}, {"_id": 0, "time": 1, "remaining": 1}
+    ).to_list(None)
+    remaining = {slot["time"]: slot["remaining"] for slot in slots}
+    # Today's slots that already started are not offered
+    return FastJSONResponse([
+        {"time": slot_time, "remaining": remaining.get(slot_time, RESERVATION_SLOT_CAPACITY),
+         "available": remaining.get(slot_time, RESERVATION_SLOT_CAPACITY) >= party_size}
+        for slot_time in RESERVATION_SLOT_TIMES if not slot_has_passed(requested_day, slot_time)
+    ])
+
+@api_router.post("/reservations", response_model=Reservation, status_code=201)
+async def create_reservation(request: ReservationCreate, location_id: str = Depends(get_location_id)):
+    requested_day = parse_reservation_date(request.date)
+    day = requested_day.isoformat()
+    if request.time not in RESERVATION_SLOT_TIMES:
+        raise HTTPException(status_code=400, detail="Invalid time slot")
+    if slot_has_passed(requested_day, request.time):
+        raise HTTPException(status_code=400, detail="Time slot has already passed")
+    await ensure_slots(location_id, day)
+
+    # Take the covers atomically: matches only while enough remain
+    slot = await db.reservation_slots.find_one_and_update(
+        {"location_id": location_id, "date": day, "time": request.time, "remaining": {"$gte": request.party_size}},
+        {"$inc": {"remaining": -request.party_size}},
+        projection={"_id": 0, "remaining": 1}
+    )
+    if slot is None:
+        raise HTTPException(status_code=409, detail="Time slot is full")
+
+    reservation = Reservation(**request.model_dump(), location_id=location_id)
+    try:
+        await db.reservations.insert_one(reservation.model_dump())
+    except Exception:
+        await release_covers(reservation.model_dump())
+        raise
+    return reservation
+
+@api_router.get("/reservations", response_model=List[Reservation])
+async def get_reservations(date: str, location_id: str = Depends(get_location_id),
+                           current_user: dict = Depends(get_current_user)):
+    reservations = await db.reservations.find(
+        {"location_id": location_id, "date": date}, response_projection(Reservation)
+    ).sort("time", 1).to_list(1000)
+    return FastJSONResponse(trusted_rows(Reservation, reservations))
+
+@api_router.post("/reservations/{reservation_id}/cancel", response_model=Reservation)
+async def cancel_reservation(reservation_id: str, current_user: dict = Depends(get_current_user)):
+    # Only the request that flips the status gives the covers back
+    reservation = await db.reservations.find_one_and_update(
+        {"id": reservation_id, "status": "confirmed"},
+        {"$set": {"status": "cancelled"}},
+        projection=response_projection(Reservation)
+    )
+    if reservation is None:
+        raise HTTPException(status_code=404, detail="Confirmed reservation not found")
+    await release_covers(reservation)
+    reservation["status"] = "cancelled"
+    audit_change(reservation_id, {"status": "cancelled"})
+    return FastJSONResponse(trusted_rows(Reservation, [reservation])[0])
+
+# ================== WHATSAPP ==================
+# Pre-filled WhatsApp messages (wa.me deep links) for a cart and/or a reservation.
+# Templates are compiled once per (language, WHATSAPP_TEMPLATE_VERSION) and menu items
+# come from an id index kept in menu_cache, so a warm render never touches Mongo.
+# Bump WHATSAPP_TEMPLATE_VERSION when editing WHATSAPP_TEMPLATES.
+
+WHATSAPP_NUMBER = os.environ.get('WHATSAPP_NUMBER', '523221393087')
+WHATSAPP_TEMPLATE_VERSION = 1
+WHATSAPP_TEMPLATES = {
+    "es": {
+        "default": "Hola, quiero información de Maizul. ¿Tienen mesa disponible hoy?",
+        "reservation": "Hola, quiero reservar en Maizul:\nNombre: ${name}\nFecha: ${date}\nHora: ${time}\nPersonas: ${party_size}",
+        "notes": "Notas: ${notes}",
+        "order": "Hola, quiero ordenar en Maizul:\n${lines}\nTotal: ${total}",
+        "line": "• ${quantity} × ${name} (${price})",
+    },
+    "en": {
+        "default": "Hi! I'd like info about Maizul. Do you have availability today?",
+        "reservation": "Hi! I'd like to book a table at Maizul:\nName: ${name}\nDate: ${date}\nTime: ${time}\nParty size: ${party_size}",
+        "notes": "Notes: ${notes}",
+        "order": "Hi! I'd like to order at Maizul:\n${lines}\nTotal: ${total}",
+        "line": "• ${quantity} × ${name} (${price})",
+    },
+}
+
+@lru_cache(maxsize=None)
+def compiled_templates(language: str, version: int) -> dict:
+    return {name: Template(text) for name, text in WHATSAPP_TEMPLATES[language].items()}
+
+def format_price(amount: float) -> str:
+    # Cents only when there are any: $145 MXN, $89.50 MXN
+    if round(amount, 2) == round(amount):
+        return f"${amount:,.0f} MXN"
+    return f"${amount:,.2f} MXN"
+
+async def get_menu_index(location_id: str) -> dict:
+    """Available menu items of a location by id, cached with the location's menu"""
+    index = menu_cache.get(location_id, "index")
+    if index is None:
+        await require_db()
+        version = menu_cache.version(location_id)
+        items = await db.menu_items.find(
+            {"location_id": location_id, "deleted_at": None, "is_available": True}, response_projection(MenuItem)
+        ).to_list(None)
+        rows = trusted_rows(MenuItem, items)
+        index = {item["id"]: item for item in rows}
+        menu_cache.put(location_id, "index", version, index, size=len(dump_json(rows)))
+    return index
+
+def render_whatsapp(request: WhatsAppRenderRequest, menu_index: dict) -> dict:
+    templates = compiled_templates(request.language, WHATSAPP_TEMPLATE_VERSION)
+    name_field = f"name_{request.language}"
+    parts = []
+
+    if request.reservation:
+        text = templates["reservation"].substitute(request.reservation.model_dump())
+        if request.reservation.notes:
+            text += "\n" + templates["notes"].substitute(notes=request.reservation.notes)
+        parts.append(text)
+
+    if request.items:
+        lines = []
+        total = 0.0
+        for entry in request.items:
+            item = menu_index[entry.item_id]
+            total += item["price"] * entry.quantity
+            lines.append(templates["line"].substitute(
+                quantity=entry.quantity, name=item[name_field], price=format_price(item["price"])
+            ))
+        parts.append(templates["order"].substitute(lines="\n".join(lines), total=format_price(total)))
+
+    message = "\n\n".join(parts) if parts else templates["default"].template
+    return {
+        "language": request.language,
+        "template_version": WHATSAPP_TEMPLATE_VERSION,
+        "message": message,
+        "url": f"https://wa.me/{WHATSAPP_NUMBER}?text={quote(message)}",
+    }
+
+# Registered on the app: a warm or reservation-only render needs no database, and a cold
+# menu index answers 503 from get_menu_index while it is unavailable
+@app.post("/api/whatsapp/render", response_model=WhatsAppMessage)
+async def render_whatsapp_message(request: WhatsAppRenderRequest, location_id: str = Depends(get_location_id)):
+    menu_index = await get_menu_index(location_id) if request.items else {}
+    unknown = [entry.item_id for entry in request.items if entry.item_id not in menu_index]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Menu items not available: {', '.join(unknown)}")
+    return FastJSONResponse(render_whatsapp(request, menu_index))
+
+# ================== AUDIT ROUTES (Admin only) ==================
+
+@api_router.get("/audit", response_model=List[AuditEvent])
+async def get_audit_log(username: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                        limit: int = Query(100, ge=1, le=1000), admin: dict = Depends(require_admin)):
+    """Audit events, newest first, filtered by actor username and ISO time range"""
+    query = {}
+    if username:
+        query["actor"] = username
+    since, until = parse_timestamp(since, "since"), parse_timestamp(until, "until")
+    if since or until:
+        query["at"] = {}
+        if since:
+            query["at"]["$gte"] = since
+        if until:
+            query["at"]["$lte"] = until
+    events = await db.audit_log.find(query, response_projection(AuditEvent)).sort("at", -1).to_list(limit)
+    return FastJSONResponse(trusted_rows(AuditEvent, events))
 
 # ================== SEED DATA ==================
 
+# Sample menu items created by the first seed
+SAMPLE_MENU_ITEMS = [
+    # Breakfast
+    {"category": "breakfast", "name_es": "Chilaquiles Verdes", "name_en": "Green Chilaquiles", 
+     "description_es": "Tortilla frita con salsa verde, crema, queso y huevo", "description_en": "Fried tortilla with green salsa, cream, cheese and egg",
+     "price": 145, "is_featured": True, "sort_order": 1, "tags": ["popular"], "image": "https://images.unsplash.com/photo-1534352956036-cd81e27dd615?w=400"},
+    {"category": "breakfast", "name_es": "Huevos Rancheros", "name_en": "Ranch-Style Eggs",
+     "description_es": "Huevos fritos sobre tortilla con salsa ranchera", "description_en": "Fried eggs on tortilla with ranchera sauce",
+     "price": 125, "sort_order": 2, "tags": [], "image": "https://images.unsplash.com/photo-1528712306091-ed0763094c98?w=400"},
+    {"category": "breakfast", "name_es": "Molletes Maizul", "name_en": "Maizul Molletes",
+     "description_es": "Pan con frijoles, queso gratinado y pico de gallo", "description_en": "Bread with beans, melted cheese and pico de gallo",
+     "price": 115, "sort_order": 3, "tags": ["vegetarian"], "image": "https://images.unsplash.com/photo-1565299585323-38d6b0865b47?w=400"},
+    {"category": "breakfast", "name_es": "Hot Cakes con Frutas", "name_en": "Pancakes with Fruits",
+     "description_es": "Torre de hot cakes con frutas frescas y miel de maple", "description_en": "Stack of pancakes with fresh fruits and maple syrup",
+     "price": 135, "sort_order": 4, "tags": ["vegetarian"], "image": "https://images.unsplash.com/photo-1567620905732-2d1ec7ab7445?w=400"},
+    # Lunch
+    {"category": "lunch", "name_es": "Tacos de Pescado", "name_en": "Fish Tacos",
+     "description_es": "Tacos de pescado fresco con pico de gallo y chipotle", "description_en": "Fresh fish tacos with pico de gallo and chipotle",
+     "price": 185, "is_featured": True, "sort_order": 1, "tags": ["popular", "specialty"], "image": "https://images.unsplash.com/photo-1551504734-5ee1c4a1479b?w=400"},
+    {"category": "lunch", "name_es": "Aguachile Maizul", "name_en": "Maizul Aguachile",
+     "description_es": "Camarón fresco en jugo de limón con pepino y chile serrano", "description_en": "Fresh shrimp in lime juice with cucumber and serrano pepper",
+     "price": 225, "is_featured": True, "sort_order": 2, "tags": ["popular", "specialty"], "image": "https://images.unsplash.com/photo-1681394421550-83cc9341b9f8?w=400"},
+    {"category": "lunch", "name_es": "Bowl de Pollo Mediterráneo", "name_en": "Mediterranean Chicken Bowl",
+     "description_es": "Pollo a las hierbas con quinoa, verduras y hummus", "description_en": "Herb chicken with quinoa, vegetables and hummus",
+     "price": 195, "sort_order": 3, "tags": [], "image": "https://images.unsplash.com/photo-1546069901-ba9599a7e63c?w=400"},
+    {"category": "lunch", "name_es": "Ensalada Tropical", "name_en": "Tropical Salad",
+     "description_es": "Mix de lechugas, mango, aguacate y vinagreta de limón", "description_en": "Mixed greens, mango, avocado and lime vinaigrette",
+     "price": 155, "sort_order": 4, "tags": ["vegetarian"], "image": "https://images.unsplash.com/photo-1512621776951-a57141f2eefd?w=400"},
+    # Dinner
+    {"category": "dinner", "name_es": "Rib Eye al Carbón", "name_en": "Charcoal Rib Eye",
+     "description_es": "Corte premium de 400g con guarnición", "description_en": "Premium 400g cut with sides",
+     "price": 485, "is_featured": True, "sort_order": 1, "tags": ["specialty"], "image": "https://images.unsplash.com/photo-1544025162-d76694265947?w=400"},
+    {"category": "dinner", "name_es": "Pulpo a las Brasas", "name_en": "Grilled Octopus",
+     "description_es": "Pulpo perfectamente asado con papas y chimichurri", "description_en": "Perfectly grilled octopus with potatoes and chimichurri",
+     "price": 395, "is_featured": True, "sort_order": 2, "tags": ["specialty"], "image": "https://images.unsplash.com/photo-1565557623262-b51c2513a641?w=400"},
+    {"category": "dinner", "name_es": "Salmón Glaseado", "name_en": "Glazed Salmon",
+     "description_es": "Salmón con glaseado de miel y soya, vegetales al vapor", "description_en": "Salmon with honey soy glaze, steamed vegetables",
+     "price": 345, "sort_order": 3, "tags": [], "image": "https://images.unsplash.com/photo-1467003909585-2f8a72700288?w=400"},
+    {"category": "dinner", "name_es": "Pasta Mariscos", "name_en": "Seafood Pasta",
+     "description_es": "Linguini con camarones, pulpo y mejillones en salsa blanca", "description_en": "Linguini with shrimp, octopus and mussels in white sauce",
+     "price": 295, "sort_order": 4, "tags": ["popular"], "image": "https://images.unsplash.com/photo-1473093295043-cdd812d0e601?w=400"},
+]
+
 @api_router.post("/seed", response_model=dict)
 async def seed_database():
     """Seed initial data - creates admin if not exists"""
@@ -327,51 +1676,10 @@ async def seed_database():
     menu_count = await db.menu_items.count_documents({})
     if menu_count == 0:
         # Create sample menu items
-        sample_items = [
-            # Breakfast
-            {"category": "breakfast", "name_es": "Chilaquiles Verdes", "name_en": "Green Chilaquiles", 
-             "description_es": "Tortilla frita con salsa verde, crema, queso y huevo", "description_en": "Fried tortilla with green salsa, cream, cheese and egg",
-             "price": 145, "is_featured": True, "sort_order": 1, "tags": ["popular"], "image": "https://images.unsplash.com/photo-1534352956036-cd81e27dd615?w=400"},
-            {"category": "breakfast", "name_es": "Huevos Rancheros", "name_en": "Ranch-Style Eggs",
-             "description_es": "Huevos fritos sobre tortilla con salsa ranchera", "description_en": "Fried eggs on tortilla with ranchera sauce",
-             "price": 125, "sort_order": 2, "tags": [], "image": "https://images.unsplash.com/photo-1528712306091-ed0763094c98?w=400"},
-            {"category": "breakfast", "name_es": "Molletes Maizul", "name_en": "Maizul Molletes",
-             "description_es": "Pan con frijoles, queso gratinado y pico de gallo", "description_en": "Bread with beans, melted cheese and pico de gallo",
-             "price": 115, "sort_order": 3, "tags": ["vegetarian"], "image": "https://images.unsplash.com/photo-1565299585323-38d6b0865b47?w=400"},
-            {"category": "breakfast", "name_es": "Hot Cakes con Frutas", "name_en": "Pancakes with Fruits",
-             "description_es": "Torre de hot cakes con frutas frescas y miel de maple", "description_en": "Stack of pancakes with fresh fruits and maple syrup",
-             "price": 135, "sort_order": 4, "tags": ["vegetarian"], "image": "https://images.unsplash.com/photo-1567620905732-2d1ec7ab7445?w=400"},
-            # Lunch
-            {"category": "lunch", "name_es": "Tacos de Pescado", "name_en": "Fish Tacos",
-             "description_es": "Tacos de pescado fresco con pico de gallo y chipotle", "description_en": "Fresh fish tacos with pico de gallo and chipotle",
-             "price": 185, "is_featured": True, "sort_order": 1, "tags": ["popular", "specialty"], "image": "https://images.unsplash.com/photo-1551504734-5ee1c4a1479b?w=400"},
-            {"category": "lunch", "name_es": "Aguachile Maizul", "name_en": "Maizul Aguachile",
-             "description_es": "Camarón fresco en jugo de limón con pepino y chile serrano", "description_en": "Fresh shrimp in lime juice with cucumber and serrano pepper",
-             "price": 225, "is_featured": True, "sort_order": 2, "tags": ["popular", "specialty"], "image": "https://images.unsplash.com/photo-1681394421550-83cc9341b9f8?w=400"},
-            {"category": "lunch", "name_es": "Bowl de Pollo Mediterráneo", "name_en": "Mediterranean Chicken Bowl",
-             "description_es": "Pollo a las hierbas con quinoa, verduras y hummus", "description_en": "Herb chicken with quinoa, vegetables and hummus",
-             "price": 195, "sort_order": 3, "tags": [], "image": "https://images.unsplash.com/photo-1546069901-ba9599a7e63c?w=400"},
-            {"category": "lunch", "name_es": "Ensalada Tropical", "name_en": "Tropical Salad",
-             "description_es": "Mix de lechugas, mango, aguacate y vinagreta de limón", "description_en": "Mixed greens, mango, avocado and lime vinaigrette",
-             "price": 155, "sort_order": 4, "tags": ["vegetarian"], "image": "https://images.unsplash.com/photo-1512621776951-a57141f2eefd?w=400"},
-            # Dinner
-            {"category": "dinner", "name_es": "Rib Eye al Carbón", "name_en": "Charcoal Rib Eye",
-             "description_es": "Corte premium de 400g con guarnición", "description_en": "Premium 400g cut with sides",
-             "price": 485, "is_featured": True, "sort_order": 1, "tags": ["specialty"], "image": "https://images.unsplash.com/photo-1544025162-d76694265947?w=400"},
-            {"category": "dinner", "name_es": "Pulpo a las Brasas", "name_en": "Grilled Octopus",
-             "description_es": "Pulpo perfectamente asado con papas y chimichurri", "description_en": "Perfectly grilled octopus with potatoes and chimichurri",
-             "price": 395, "is_featured": True, "sort_order": 2, "tags": ["specialty"], "image": "https://images.unsplash.com/photo-1565557623262-b51c2513a641?w=400"},
-            {"category": "dinner", "name_es": "Salmón Glaseado", "name_en": "Glazed Salmon",
-             "description_es": "Salmón con glaseado de miel y soya, vegetales al vapor", "description_en": "Salmon with honey soy glaze, steamed vegetables",
-             "price": 345, "sort_order": 3, "tags": [], "image": "https://images.unsplash.com/photo-1467003909585-2f8a72700288?w=400"},
-            {"category": "dinner", "name_es": "Pasta Mariscos", "name_en": "Seafood Pasta",
-             "description_es": "Linguini con camarones, pulpo y mejillones en salsa blanca", "description_en": "Linguini with shrimp, octopus and mussels in white sauce",
-             "price": 295, "sort_order": 4, "tags": ["popular"], "image": "https://images.unsplash.com/photo-1473093295043-cdd812d0e601?w=400"},
-        ]
-        
-        for item_data in sample_items:
+        for item_data in SAMPLE_MENU_ITEMS:
             item = MenuItem(**item_data)
             await db.menu_items.insert_one(item.model_dump())
+        menu_cache.clear()
     
     return {"message": "Database seeded successfully", "admin_username": "admin", "admin_password": "Damian.01"}
 
@@ -381,26 +1689,67 @@ async def seed_database():
 async def root():
     return {"status": "ok", "app": "Maizul Restaurant API", "version": "1.0"}
 
-@api_router.get("/health")
+# Registered on the app so it answers while the database is still connecting
+@app.get("/api/health")
 async def health_check():
     db_status = "connected"
     try:
-        if client:
+        if client and db_ready:
             await client.admin.command('ping')
+        elif db_last_error:
+            db_status = f"connecting: {db_last_error}"
         else:
             db_status = "not_initialized"
     except Exception as e:
+        mark_db_unavailable(e)
         db_status = f"error: {str(e)}"
     
     return {
         "status": "healthy", 
         "database": db_status,
+        "schema_drift": schema_drift_count,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
 # Include the router in the main app
 app.include_router(api_router)
 
+class DatabaseGuardMiddleware:
+    """Turn Mongo connectivity errors into 503s and trigger a background reconnect"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            if response_started or not (DB_UNAVAILABLE_ERRORS and isinstance(e, DB_UNAVAILABLE_ERRORS)):
+                raise
+            mark_db_unavailable(e)
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Database unavailable, please retry shortly"},
+                headers={"Retry-After": "5"}
+            )
+            await response(scope, receive, send)
+
+app.add_middleware(AuditMiddleware)
+app.add_middleware(CompressionMiddleware)
+# Inside CORS so browsers can read the 503
+app.add_middleware(DatabaseGuardMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -416,19 +1765,81 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
-async def startup_event():
+# ================== LIFECYCLE ==================
+# On SIGTERM uvicorn stops accepting connections and waits up to --timeout-graceful-shutdown
+# for in-flight requests before it runs the shutdown hook. The hook then flushes the
+# event buffer and drains the revision/audit queues, logs final counters, stops the
+# background tasks and only then closes the Motor pool - all within SHUTDOWN_DRAIN_SECONDS.
+
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get('SHUTDOWN_DRAIN_SECONDS', '20'))
+
+background_tasks = []
+_event_flusher_task = None
+
+def start_background_task(coro):
+    # Keep a reference: the loop only holds weak ones, and shutdown cancels these
+    task = asyncio.create_task(coro)
+    background_tasks.append(task)
+    return task
+
+async def drain(what: str, awaitable, deadline: float) -> bool:
     try:
-        await init_db()
-        # Auto-seed on startup
-        existing_admin = await db.users.find_one({"role": "admin"})
-        if not existing_admin:
-            logger.info("No admin found, seeding database...")
-            await seed_database()
+        await asyncio.wait_for(awaitable, max(0.0, deadline - time.monotonic()))
+        return True
+    except asyncio.TimeoutError:
+        logger.warning(f"Shutdown deadline reached while draining {what}")
+        return False
     except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        logger.warning("Server starting without database - /api/seed will initialize when DB is available")
+        logger.error(f"Draining {what} failed: {e}")
+        return False
+
+async def flush_event_buffer():
+    while len(event_buffer) or _unscored_batches:
+        await flush_events()
+
+def log_final_metrics():
+    logger.info("Shutdown metrics: " + dump_json({
+        "events_pending": len(event_buffer),
+        "events_rejected": event_buffer.rejected,
+        "events_unscored": sum(len(events) for _, events in _unscored_batches),
+        "revisions_pending": revision_queue.qsize(),
+        "audit_pending": audit_queue.qsize(),
+        "audit_dropped": audit_dropped,
+        "schema_drift": schema_drift_count,
+    }).decode("utf-8"))
+
+IMPORT_TIME_MS = (time.perf_counter() - _IMPORT_STARTED) * 1000
+
+@app.on_event("startup")
+async def startup_event():
+    global _event_flusher_task
+    logger.info(f"Server module imported in {IMPORT_TIME_MS:.0f} ms")
+    # Connect in the background so the server binds right away even if Mongo is slow;
+    # routes answer 503 until the first ping succeeds
+    schedule_db_connect()
+    start_background_task(revision_writer())
+    _event_flusher_task = start_background_task(event_flusher())
+    start_background_task(audit_writer())
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    logger.info("Shutting down: draining background work")
+    if _event_flusher_task is not None:
+        # Stop the periodic flusher before the final flush; a batch it had in flight goes
+        # back to the buffer, so the buffer cannot look empty while events are still unsaved
+        _event_flusher_task.cancel()
+        await asyncio.gather(_event_flusher_task, return_exceptions=True)
+    if db_ready:
+        # The other writers keep running while we wait, so joining the queues flushes them
+        await drain("menu events", flush_event_buffer(), deadline)
+        await drain("menu revisions", revision_queue.join(), deadline)
+        await drain("audit events", audit_queue.join(), deadline)
+    log_final_metrics()
+
+    for task in background_tasks + [_db_connect_task]:
+        if task is not None:
+            task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if client is not None:
+        client.close()
@@ -2,7 +2,9 @@
 import requests
 import sys
 import json
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 class MaizulAPITester:
@@ -209,6 +211,43 @@ class MaizulAPITester:
             204
         )
         
+        if not success:
+            return False
+
+        # Soft-deleted items are hidden but keep their history
+        success, response = self.run_test(
+            "Read Deleted Menu Item",
+            "GET",
+            f"menu/{created_id}",
+            404
+        )
+        
+        if not success:
+            return False
+
+        success, response = self.run_test(
+            "Restore Menu Item",
+            "POST",
+            f"menu/{created_id}/restore",
+            200
+        )
+        
+        if not success:
+            return False
+
+        self.run_test("Delete Restored Menu Item", "DELETE", f"menu/{created_id}", 204)
+        return self.test_menu_history()
+
+    def test_menu_history(self):
+        """Test point-in-time menu reconstruction"""
+        success, response = self.run_test(
+            "Get Menu History",
+            "GET",
+            "menu/history",
+            200
+        )
+        if success:
+            print(f"   🕰️  Revision {response.get('seq')}: {len(response.get('items', []))} items")
         return success
 
     def test_user_management(self):
@@ -272,6 +311,206 @@ class MaizulAPITester:
         
         return success
 
+    def test_events_ingestion(self):
+        """Test buffered analytics ingestion and the popular items view"""
+        if not self.menu_items:
+            print("   ⚠️  Skipping events tests - no menu items")
+            return True
+
+        events = [{"type": "view", "item_id": item["id"]} for item in self.menu_items[:5]]
+        events.append({"type": "click", "item_id": self.menu_items[0]["id"]})
+        success, response = self.run_test(
+            "Ingest Menu Events",
+            "POST",
+            "events",
+            202,
+            data={"events": events}
+        )
+        if not success:
+            return False
+
+        success, response = self.run_test(
+            "Drop Events For Unknown Items",
+            "POST",
+            "events",
+            202,
+            data={"events": [{"type": "click", "item_id": "not-a-menu-item"}]}
+        )
+        if not success or response.get("dropped") != 1:
+            print(f"   ❌ Expected the unknown item to be dropped, got {response}")
+            return False
+
+        success, response = self.run_test(
+            "Get Popular Items",
+            "GET",
+            "events/popular",
+            200
+        )
+        return success
+
+    def test_whatsapp_render(self):
+        """Test WhatsApp message rendering for a cart and for a reservation"""
+        available = [item for item in self.menu_items if item.get("is_available")]
+        if not available:
+            print("   ⚠️  Skipping WhatsApp tests - no available menu items")
+            return True
+
+        success, response = self.run_test(
+            "Render WhatsApp Cart",
+            "POST",
+            "whatsapp/render",
+            200,
+            data={"language": "en", "items": [{"item_id": item["id"], "quantity": 2} for item in available[:2]]}
+        )
+        if not success or not response.get("url", "").startswith("https://wa.me/"):
+            return False
+        if available[0]["name_en"] not in response.get("message", ""):
+            print(f"   ❌ Cart item missing from message: {response.get('message')}")
+            return False
+
+        day = (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d")
+        success, response = self.run_test(
+            "Render WhatsApp Reservation",
+            "POST",
+            "whatsapp/render",
+            200,
+            data={"language": "es", "reservation": {"name": "Ana Test", "date": day, "time": "20:00", "party_size": 4}}
+        )
+        if not success or "Ana Test" not in response.get("message", ""):
+            return False
+
+        success, response = self.run_test(
+            "Render WhatsApp Unknown Item",
+            "POST",
+            "whatsapp/render",
+            404,
+            data={"items": [{"item_id": "not-a-menu-item"}]}
+        )
+        return success
+
+    def test_audit_log(self):
+        """Test that admin mutations land in the audit log with the actor, route and a masked diff"""
+        if not self.admin_user or self.admin_user.get('role') != 'admin':
+            print("   ⚠️  Skipping audit tests - not admin")
+            return True
+
+        since = (datetime.now(timezone.utc) - timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        success, response = self.run_test(
+            "Create Audited User",
+            "POST",
+            "users",
+            201,
+            data={"username": f"audit_user_{int(datetime.now().timestamp())}", "password": "TestPass123!", "role": "editor"}
+        )
+        if not success:
+            return False
+        user_id = response.get('id')
+
+        success, response = self.run_test(
+            "Change Audited User Password",
+            "PUT",
+            f"users/{user_id}",
+            200,
+            data={"password": "OtherPass456!"}
+        )
+        if not success:
+            return False
+
+        # Events are written in the background, give the writer a moment
+        event = None
+        for _ in range(5):
+            success, events = self.run_test(
+                "Get Audit Log",
+                "GET",
+                f"audit?username={self.admin_user.get('username')}&since={since}",
+                200
+            )
+            if not success:
+                return False
+            event = next((e for e in events if e.get("method") == "PUT" and user_id in e.get("diff", {})), None)
+            if event:
+                break
+            time.sleep(1)
+
+        if not event:
+            print("   ❌ Password change not found in the audit log")
+            return False
+        if event.get("actor") != self.admin_user.get('username') or event.get("route") != "/api/users/{user_id}":
+            print(f"   ❌ Unexpected actor/route: {event.get('actor')} {event.get('route')}")
+            return False
+        if event["diff"][user_id].get("password_hash") != "***":
+            print(f"   ❌ Password hash not masked: {event['diff'][user_id]}")
+            return False
+
+        success, response = self.run_test(
+            "Get Audit Log With Invalid Since",
+            "GET",
+            "audit?since=yesterday",
+            400
+        )
+        if not success:
+            return False
+
+        success, response = self.run_test(
+            "Delete Audited User",
+            "DELETE",
+            f"users/{user_id}",
+            204
+        )
+        return success
+
+    def test_reservation_concurrency(self, bookings=300, party_size=2):
+        """Load test: a burst of simultaneous bookings for one slot must never overbook it"""
+        day = (datetime.now() + timedelta(days=45)).strftime("%Y-%m-%d")
+        success, slots = self.run_test(
+            "Get Reservation Availability",
+            "GET",
+            f"reservations/availability?date={day}&party_size={party_size}",
+            200
+        )
+        if not success or not slots:
+            return False
+        slot = max(slots, key=lambda s: s["remaining"])
+        before = slot["remaining"]
+
+        body = {"name": "Load Test", "phone": "3220000000", "party_size": party_size,
+                "date": day, "time": slot["time"], "notes": "backend_test.py"}
+
+        def book(_):
+            response = requests.post(f"{self.base_url}/reservations", json=body, timeout=30)
+            return response.status_code, response.json() if response.status_code == 201 else None
+
+        print(f"\n🔍 Testing {bookings} simultaneous bookings for {day} {slot['time']} ({before} covers free)...")
+        with ThreadPoolExecutor(max_workers=100) as pool:
+            results = list(pool.map(book, range(bookings)))
+        created = [reservation for status_code, reservation in results if status_code == 201]
+        rejected = sum(1 for status_code, _ in results if status_code == 409)
+
+        _, slots = self.run_test(
+            "Get Availability After Burst",
+            "GET",
+            f"reservations/availability?date={day}&party_size={party_size}",
+            200
+        )
+        after = next(s["remaining"] for s in slots if s["time"] == slot["time"])
+        expected = min(bookings, before // party_size)
+
+        self.tests_run += 1
+        if len(created) == expected and len(created) + rejected == bookings and after == before - len(created) * party_size:
+            self.tests_passed += 1
+            print(f"   ✅ Passed - {len(created)} booked, {rejected} rejected, {after} covers left")
+            ok = True
+        else:
+            print(f"   ❌ Failed - {len(created)} booked (expected {expected}), {rejected} rejected, {after} covers left")
+            self.failed_tests.append({'test': "Reservation Concurrency", 'error': f"{len(created)} booked, expected {expected}"})
+            ok = False
+
+        # Give the covers back
+        for reservation in created:
+            requests.post(f"{self.base_url}/reservations/{reservation['id']}/cancel",
+                          headers={'Authorization': f'Bearer {self.token}'}, timeout=10)
+        return ok
+
     def test_unauthorized_access(self):
         """Test accessing protected endpoints without token"""
         old_token = self.token
@@ -343,9 +582,15 @@ class MaizulAPITester:
         self.test_get_menu_all_categories()
         self.test_menu_search_scenarios()
         self.test_menu_item_crud()
+        self.test_events_ingestion()
+        self.test_whatsapp_render()
+
+        # Reservations
+        self.test_reservation_concurrency()
 
         # User management (admin only)
         self.test_user_management()
+        self.test_audit_log()
 
         # Print results
         print("\n" + "=" * 60)